@@ -1,21 +1,152 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
+import ast
+import logging
+import re
+from collections import namedtuple
 from email.header import Header
 from email.mime.text import MIMEText
-from io import StringIO
-from csv import reader
-from datetime import datetime, date, time
-from decimal import Decimal
+from io import BytesIO, TextIOWrapper
+from itertools import chain, islice
+from operator import itemgetter
+from csv import Dialect, QUOTE_MINIMAL, reader
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from trytond import backend
 from trytond.config import config
+from trytond.exceptions import UserError
 from trytond.model import fields, ModelSQL, ModelView
 from trytond.pool import Pool
 from trytond.pyson import Bool, Eval, In, Not
 from trytond.pyson import PYSON, PYSONEncoder, PYSONDecoder
 from trytond.sendmail import sendmail
+from trytond.tools import grouped_slice
 from trytond.transaction import Transaction
 
 __all__ = ['ImportCSV', 'ImportCSVColumn', 'ImportCSVFile']
 
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+# log lines of the rows kept for the result email
+LOG_LINES = 1000
+
+INTEGER = re.compile(r'^\s*[-+]?\d+\s*$', re.UNICODE)
+NUMERIC = re.compile(r'^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$',
+    re.UNICODE)
+# log lines are only formatted when the result is sent
+LogLine = namedtuple('LogLine', ['status', 'error_message', 'error_args'])
+BOOLEAN_TRUE = frozenset(
+    ['1', 'true', 't', 'yes', 'y', 'on', 'si', u's\xed', 's'])
+BOOLEAN_FALSE = frozenset(['0', 'false', 'f', 'no', 'n', 'off'])
+# strptime directives parsed by date_format_pattern
+DATE_DIRECTIVES = {
+    'Y': r'(?P<year>\d{4})',
+    'm': r'(?P<month>1[0-2]|0[1-9]|[1-9])',
+    'd': r'(?P<day>3[01]|[12]\d|0[1-9]|[1-9]| [1-9])',
+    'H': r'(?P<hour>2[0-3]|[0-1]\d|\d)',
+    'M': r'(?P<minute>[0-5]\d|\d)',
+    'S': r'(?P<second>6[0-1]|[0-5]\d|\d)',
+    }
+
+
+def chunked(iterable, size):
+    'Yield lists of size items from iterable'
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def save_errors():
+    '''Return the exceptions raised when the records of a chunk can not be
+    saved'''
+    return (UserError, backend.get('DatabaseIntegrityError'),
+        backend.get('DatabaseOperationalError'))
+
+
+def domain_key(domain):
+    '''Return a hashable key of the domain'''
+    return tuple(domain_key(clause) if isinstance(clause, list) else clause
+        for clause in domain)
+
+
+def split_rows(lines, dialect):
+    '''Split CSV lines in fields. Lines are split by str.split until one has
+    the quote character, and by the csv reader from there'''
+    lines = iter(lines)
+    for line in lines:
+        if dialect.quotechar in line:
+            # the lines before have no quoted fields, so the csv reader
+            # starts at the beginning of a row
+            for row in reader(chain([line], lines), dialect=dialect):
+                yield row
+            return
+        line = line.rstrip('\r\n')
+        yield line.split(dialect.delimiter) if line else []
+
+
+def match_literals(expression):
+    '''Return the (index, literal) pairs of a match expression made only of
+    row[index] == literal comparisons joined with and, or None'''
+    try:
+        node = ast.parse(expression, mode='eval').body
+    except SyntaxError:
+        return
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+        comparisons = node.values
+    else:
+        comparisons = [node]
+    literals = []
+    for comparison in comparisons:
+        if not (isinstance(comparison, ast.Compare)
+                and len(comparison.ops) == 1
+                and isinstance(comparison.ops[0], ast.Eq)):
+            return
+        cell = comparison.left
+        if not (isinstance(cell, ast.Subscript)
+                and isinstance(cell.value, ast.Name)
+                and cell.value.id == 'row'):
+            return
+        index = cell.slice
+        if isinstance(index, getattr(ast, 'Index', ())):
+            index = index.value
+        try:
+            index = ast.literal_eval(index)
+            literal = ast.literal_eval(comparison.comparators[0])
+        except ValueError:
+            return
+        if not isinstance(index, int) or isinstance(index, bool):
+            return
+        literals.append((index, literal))
+    return literals
+
+
+def date_format_pattern(date_format):
+    '''Compile a regular expression for the strptime date format.
+    Return None if the format has directives not in DATE_DIRECTIVES'''
+    pattern = []
+    directives = set()
+    i = 0
+    while i < len(date_format):
+        char = date_format[i]
+        if char == '%':
+            directive = date_format[i + 1:i + 2]
+            if directive not in DATE_DIRECTIVES or directive in directives:
+                return
+            directives.add(directive)
+            pattern.append(DATE_DIRECTIVES[directive])
+            i += 2
+            continue
+        elif char.isspace():
+            pattern.append(r'\s+')
+        else:
+            pattern.append(re.escape(char))
+        i += 1
+    return re.compile(''.join(pattern) + '$', re.IGNORECASE)
+
 
 class ImportCSV(ModelSQL, ModelView):
     'Import CSV'
@@ -60,6 +191,14 @@ class ImportCSV(ModelSQL, ModelView):
         help="Decimal separator used when there is a number.")
     columns = fields.One2Many('import.csv.column', 'profile_csv', 'Columns')
 
+    @classmethod
+    def __setup__(cls):
+        super(ImportCSV, cls).__setup__()
+        cls._error_messages.update({
+                'match_expression_error': ('The "Exclude Rows" expression of '
+                    'profile "%s" is not valid:\n%s'),
+                })
+
     @classmethod
     def get_method(cls):
         '''CSV Methods'''
@@ -123,6 +262,75 @@ class ImportCSV(ModelSQL, ModelView):
     def default_decimal_separator():
         return ","
 
+    @classmethod
+    def validate(cls, profiles):
+        super(ImportCSV, cls).validate(profiles)
+        cls.check_match_expression(profiles)
+
+    @classmethod
+    def check_match_expression(cls, profiles):
+        for profile in profiles:
+            try:
+                profile.match_code
+            except SyntaxError as e:
+                cls.raise_user_error('match_expression_error',
+                    error_args=(profile.rec_name, e))
+
+    @property
+    def match_code(self):
+        'Compiled code of the match expression'
+        try:
+            return self._match_code
+        except AttributeError:
+            self._match_code = (compile(self.match_expression,
+                    '<match_expression>', 'eval')
+                if self.match_expression else None)
+            return self._match_code
+
+    @property
+    def csv_dialect(self):
+        'CSV dialect of the profile separator and quote'
+        try:
+            return self._csv_dialect
+        except AttributeError:
+            separator = self.separator
+            if separator == 'tab':
+                separator = '\t'
+            quote = self.quote or '"'
+
+            class ProfileDialect(Dialect):
+                delimiter = str(separator)
+                quotechar = str(quote)
+                doublequote = True
+                skipinitialspace = False
+                lineterminator = '\r\n'
+                quoting = QUOTE_MINIMAL
+            self._csv_dialect = ProfileDialect
+            return self._csv_dialect
+
+    @property
+    def match_cells(self):
+        '''Index and value of the cells compared by a literal match
+        expression, or None if it must be evaluated'''
+        try:
+            return self._match_cells
+        except AttributeError:
+            self._match_cells = (match_literals(self.match_expression)
+                if self.match_expression else None) or None
+            return self._match_cells
+
+    def exclude_row(self, row):
+        'Return True if the CSV row matches the match expression'
+        if self.match_code is None:
+            return False
+        match_cells = self.match_cells
+        if match_cells:
+            # row[5] == "X" and row[11] == "Y" without evaluating Python code,
+            # stopping at the first cell that does not match as "and" does
+            return all(row[index] == value for index, value in match_cells)
+        # the expression only reads the row, it has no access to builtins
+        return bool(eval(self.match_code, {'__builtins__': {}, 'row': row}))
+
 
 class ImportCSVColumn(ModelSQL, ModelView):
     'Import CSV Column'
@@ -279,22 +487,31 @@ class ImportCSVColumn(ModelSQL, ModelView):
     @classmethod
     def check_columns(cls, columns):
         for column in columns:
-            cells = column.column
-            if not cells:
-                continue
-            cells = cells.split(',')
-            for cell in cells:
-                try:
-                    int(cell)
-                except ValueError:
-                    cls.raise_user_error('columns_must_be_integers',
-                    error_args=(column.field.name,)
-                        )
+            try:
+                column.column_indices
+            except ValueError:
+                cls.raise_user_error('columns_must_be_integers',
+                    error_args=(column.field.name,))
+
+    @property
+    def column_indices(self):
+        'Positions of the CSV cells read by this column'
+        try:
+            return self._column_indices
+        except AttributeError:
+            self._column_indices = tuple(int(c)
+                for c in self.column.split(',')) if self.column else ()
+            return self._column_indices
 
     def field_required(self):
-        field = Pool().get(self.field.model.model)
-        return (field._fields[self.field.name].required
-            or field._fields[self.field.name].states.get('required', False))
+        try:
+            return self._field_required
+        except AttributeError:
+            field = Pool().get(self.field.model.model)
+            self._field_required = (field._fields[self.field.name].required
+                or field._fields[self.field.name].states.get('required',
+                    False))
+            return self._field_required
 
     @fields.depends('field')
     def on_change_with_ttype(self, name=None):
@@ -312,110 +529,90 @@ class ImportCSVColumn(ModelSQL, ModelView):
         return digits
 
     def get_numeric(self, values):
-        for value in values:
-            quantize = Decimal(10) ** -Decimal(self.digits)
-            thousands_separator = self.profile_csv.thousands_separator
-            decimal_separator = self.profile_csv.decimal_separator
-            if thousands_separator != 'none':
-                value = value.replace(thousands_separator, '')
-            if decimal_separator == ',':
-                value = value.replace(decimal_separator, '.')
+        value = values[0]
+        # without separators to change the value is already parseable
+        if self._numeric_table:
+            value = value.translate(self._numeric_table)
+        if NUMERIC.match(value):
             try:
-                value = Decimal(value).quantize(quantize)
-            except:
-                self.raise_user_error('numeric_format_error',
-                    error_args=(self.field.name, value))
-            return value
+                # values with more digits than the context precision
+                return Decimal(value).quantize(self._quantize)
+            except InvalidOperation:
+                pass
+        self.raise_user_error('numeric_format_error',
+            error_args=(self.field.name, value))
 
     def get_char(self, values):
-        result = ''
-        for value in values:
-            character_encoding = self.profile_csv.character_encoding
-            # Python3 strings can not be decoded
-            if hasattr(value, 'decode'):
-                try:
-                    value = value.decode(character_encoding)
-                except:
-                    self.raise_user_error('char_encoding_error',
-                        error_args=(self.field.name))
-            if result:
-                result += ', ' + value
-            else:
-                result = value
-        return result
+        # the first cell is never empty, so join is equivalent to adding the
+        # separator only after a value
+        return ', '.join(values)
 
     def get_text(self, values):
         return self.get_char(values)
 
     def get_integer(self, values):
-        for value in values:
-            try:
-                value = int(value)
-            except:
-                self.raise_user_error('integer_format_error',
-                    error_args=(self.field.name, value))
-            if value < -2147483648 or value > 2147483647:
-                self.raise_user_error('integer_too_big_error',
-                    error_args=(self.field.name, value))
-            return value
+        value = values[0]
+        if not INTEGER.match(value):
+            self.raise_user_error('integer_format_error',
+                error_args=(self.field.name, value))
+        value = int(value)
+        if value < -2147483648 or value > 2147483647:
+            self.raise_user_error('integer_too_big_error',
+                error_args=(self.field.name, value))
+        return value
 
     def get_datetime(self, values):
-        for value in values:
-            date_format = self.date_format
-            try:
-                value = datetime.strptime(value, date_format)
-            except ValueError:
-                self.raise_user_error('datetime_format_error',
-                    error_args=(self.field.name, value, date_format))
-            return value
+        value = values[0]
+        date_format = self._date_format
+        try:
+            match = self._date_pattern and self._date_pattern.match(value)
+            if match:
+                parts = match.groupdict()
+                return datetime(int(parts.get('year', 1900)),
+                    int(parts.get('month', 1)), int(parts.get('day', 1)),
+                    int(parts.get('hour', 0)), int(parts.get('minute', 0)),
+                    int(parts.get('second', 0)))
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            self.raise_user_error('datetime_format_error',
+                error_args=(self.field.name, value, date_format))
 
     def get_date(self, values):
-        value = self.get_datetime(values)
-        return date(value.year, value.month, value.day)
+        return self.get_datetime(values).date()
 
     def get_time(self, values):
-        for value in values:
-            date_format = self.date_format
-            try:
-                value = time.strptime(value, date_format)
-            except ValueError:
-                self.raise_user_error('datetime_format_error',
-                    error_args=(self.field.name, value, date_format))
-            return value
+        return self.get_datetime(values).time()
 
     def get_timestamp(self, values):
         return self.get_datetime(values)
 
     def get_boolean(self, values):
-        for value in values:
-            try:
-                value = bool(value)
-            except:
-                self.raise_user_error('boolean_format_error',
-                    error_args=(self.field.name, value))
-            return value
+        value = values[0]
+        token = value.strip().lower()
+        if token in BOOLEAN_TRUE:
+            return True
+        elif token in BOOLEAN_FALSE:
+            return False
+        self.raise_user_error('boolean_format_error',
+            error_args=(self.field.name, value))
 
     def get_selection(self, values):
-        value = self.get_char([values[0]])
-        map_values = self.selection or u''
-        if map_values:
-            for pair in map_values.splitlines():
-                if pair:
-                    key, map_value = pair.split(':')
-                    if key == value:
-                        value = map_value.strip()
-                        break
-        return value
+        value = values[0]
+        return self._selection_map.get(value, value)
 
     def get_many2one(self, values):
-        Model = Pool().get(self.field.relation)
-        records = Model.search([
-            ('name', '=', values[0]),
-            ])
-        if records:
-            return records[0]
-        else:
-            return
+        value = values[0]
+        # the same related record is usually repeated in many rows
+        try:
+            return self._relation_records[value]
+        except KeyError:
+            pass
+        records = self._relation_model.search([
+            ('name', '=', value),
+            ], limit=1)
+        record = records[0] if records else None
+        self._relation_records[value] = record
+        return record
 
     def get_one2many(self, values):
         return values[0]
@@ -424,11 +621,65 @@ class ImportCSVColumn(ModelSQL, ModelView):
         # TODO
         pass
 
+    @property
+    def converter(self):
+        'Method that converts the CSV values of this column'
+        try:
+            return self._converter
+        except AttributeError:
+            self.prepare()
+            self._converter = getattr(self, 'get_%s' % self.ttype)
+            return self._converter
+
+    def prepare(self):
+        'Cache the settings used to convert the CSV values of the column'
+        if self.field.relation:
+            self._relation_model = Pool().get(self.field.relation)
+            self._relation_records = {}
+        profile_csv = self.profile_csv
+        thousands_separator = profile_csv.thousands_separator
+        decimal_separator = profile_csv.decimal_separator
+        # Remove the thousands separator and use a dot as decimal separator
+        # in a single pass over the value
+        numeric_table = {}
+        if len(thousands_separator) == 1:
+            numeric_table[ord(thousands_separator)] = None
+        if decimal_separator == ',':
+            numeric_table.setdefault(ord(decimal_separator), u'.')
+        self._numeric_table = numeric_table
+        self._quantize = Decimal(10) ** -Decimal(self.digits)
+        self._date_format = self.date_format
+        selection_map = {}
+        for pair in (self.selection or '').splitlines():
+            if pair:
+                key, map_value = pair.split(':', 1)
+                selection_map.setdefault(key, map_value.strip())
+        self._selection_map = selection_map
+        # parse the usual date formats without the strptime machinery
+        self._date_pattern = (date_format_pattern(self._date_format)
+            if self._date_format else None)
+
     def get_value(self, values):
         if values and values[0]:
-            return getattr(self, 'get_%s' % self.ttype)(values)
+            return self.converter(values)
         elif self.constant:
-            return getattr(self, 'get_%s' % self.ttype)([self.constant])
+            return self.converter([self.constant])
+
+    def get_values(self, rows):
+        'Return the value of this column for each CSV row'
+        if self.constant:
+            return [self.constant] * len(rows)
+        # empty cells are not converted, as in get_value
+        converter = self.converter
+        indices = self.column_indices
+        if len(indices) == 1:
+            # most columns read a single cell
+            index, = indices
+            return [converter((row[index],)) if row[index] else None
+                for row in rows]
+        cells = itemgetter(*indices)
+        return [converter(values) if values[0] else None
+            for values in map(cells, rows)]
 
 
 class ImportCSVFile(ModelSQL, ModelView):
@@ -458,6 +709,12 @@ class ImportCSVFile(ModelSQL, ModelView):
         }, depends=['state'],
         help=('If any record of the CSV file is found with the search domain, '
             'update the record.'))
+    skip_errors = fields.Boolean('Skip Errors',
+        states={
+            'readonly': (Eval('state') != 'draft')
+        }, depends=['state'],
+        help=('If any row of the CSV file has a value that can not be '
+            'imported, skip the row instead of stopping the import.'))
     date_ = fields.DateTime('Date', required=True)
     state = fields.Selection([
         ('draft', 'Draft'),
@@ -475,9 +732,19 @@ class ImportCSVFile(ModelSQL, ModelView):
         cls._error_messages.update({
                 'csv_format_error': ('Please, check that the CSV file '
                     'configuration matches with the format of the CSV file.'),
+                'log_lines_omitted': ('%s more lines of the import are not '
+                    'shown.'),
+                'match_expression_row_error': ('The "Exclude Rows" '
+                    'expression "%s" can not be evaluated on row %s:\n%s'),
+                'file_encoding_error': ('The CSV file "%s" can not be decoded '
+                    'with the "%s" character encoding.'),
                 'record_already_exists': ('Record %s skipped. '
                     'Already exists.'),
                 'record_added': 'Record %s added.',
+                'row_skipped': 'Row %s skipped. %s',
+                'import_error': 'The import stopped with an error: %s',
+                'method_not_found': ('The import method "%s" of profile '
+                    '"%s" is not available.'),
                 'record_updated': 'Record %s updated.',
                 'email_subject': 'CSV Import result',
                 'user_email_error': '%s has not any email address',
@@ -530,37 +797,227 @@ class ImportCSVFile(ModelSQL, ModelView):
 
     def read_csv_file(self):
         '''Read CSV data'''
-        separator = self.profile_csv.separator
-        if separator == "tab":
-            separator = '\t'
-        quote = self.profile_csv.quote
-
-        file_ = self.csv_file
-        # On python3 we must convert the binary file to string
-        if hasattr(file_, 'decode'):
-            file_ = file_.decode(self.profile_csv.character_encoding)
-        data = StringIO(file_)
-        if quote:
-            rows = reader(data, delimiter=str(separator), quotechar=str(quote))
+        dialect = self.profile_csv.csv_dialect
+        character_encoding = self.profile_csv.character_encoding
+
+        # Decode the binary while the rows are read instead of keeping a
+        # decoded copy of the whole file in memory
+        data = TextIOWrapper(BytesIO(bytes(self.csv_file)),
+            encoding=character_encoding, newline='')
+        try:
+            for row in split_rows(data, dialect):
+                yield row
+        except UnicodeDecodeError:
+            self.raise_user_error('file_encoding_error',
+                error_args=(self.file_name, character_encoding))
+
+    @staticmethod
+    def search_records(Model, names, keys):
+        '''Return a dictionary with the first record of Model found for
+        each key of values of the names fields'''
+        fields_ = [Model._fields[name] for name in names]
+
+        def normalize(key):
+            # compare the values as stored, as the ones read from the file
+            # or set as constants may not have the type of the field
+            return tuple(field.sql_format(value)
+                for field, value in zip(fields_, key))
+
+        found = {}
+        # keys by their normalized values
+        in_keys = {}
+        # None values can not be searched with the in operator, nor the
+        # values the field can not store
+        eq_keys = []
+        for key in set(keys):
+            if None in key:
+                eq_keys.append(key)
+                continue
+            try:
+                in_keys.setdefault(normalize(key), []).append(key)
+            except (ValueError, TypeError, AssertionError, ArithmeticError):
+                eq_keys.append(key)
+        for sub_keys in grouped_slice(list(in_keys)):
+            sub_keys = list(sub_keys)
+            domain = [(name, 'in', list(set(key[i] for key in sub_keys)))
+                for i, name in enumerate(names)]
+            for record in Model.search(domain):
+                key = normalize(getattr(record, name) for name in names)
+                for csv_key in in_keys.get(key, []):
+                    found.setdefault(csv_key, record)
+        for key in eq_keys:
+            records = Model.search([(name, '=', value)
+                    for name, value in zip(names, key)], limit=1)
+            if records:
+                found[key] = records[0]
+        return found
+
+    @staticmethod
+    def commit_chunks():
+        '''Return True if each saved chunk is committed, as set by the
+        commit_chunks option. Otherwise the caller commits the import'''
+        return config.getboolean('import_csv', 'commit_chunks',
+            default=False)
+
+    @classmethod
+    def commit(cls):
+        '''Commit the records imported so far if chunks are committed'''
+        if cls.commit_chunks():
+            Transaction().connection.commit()
+
+    @staticmethod
+    def rollback():
+        '''Discard the changes since the last committed chunk'''
+        transaction = Transaction()
+        transaction.connection.rollback()
+        transaction.cache.clear()
+
+    @classmethod
+    def row_to_import(cls, profile_csv, row, min_cells):
+        '''Return True if the CSV row is imported, it is not empty nor
+        excluded by the match expression of the profile.
+        Raise csv_format_error if it has less than min_cells cells and
+        match_expression_row_error if the match expression can not be
+        evaluated on it'''
+        if not row:
+            return False
+        if len(row) < min_cells:
+            cls.raise_user_error('csv_format_error')
+        try:
+            return not profile_csv.exclude_row(row)
+        except (SyntaxError, IndexError, KeyError, TypeError,
+                ValueError) as e:
+            cls.raise_user_error('match_expression_row_error',
+                error_args=(profile_csv.match_expression, row, e))
+
+    @classmethod
+    def _save_chunk(cls, csv_file, save, count, logs):
+        '''Save the count records of a chunk calling save.
+        Return False if they can not be saved'''
+        try:
+            save()
+        except save_errors():
+            if not cls.commit_chunks():
+                # the caller owns the transaction and decides what to do
+                # with the records saved before the error
+                raise
+            # discard the records of the chunk saved before the error
+            cls.rollback()
+            logs.insert(0, LogLine(
+                'error',
+                'import_unsuccessfully',
+                (count,)))
+            return False
+        # keep the records of each chunk and the transaction small
+        cls.commit()
+        if not csv_file.profile_csv.email:
+            # log lines are only used by the result email
+            del logs[:]
         else:
-            rows = reader(data, delimiter=str(separator))
-        return rows
+            cls._limit_logs(csv_file, logs)
+        return True
 
     @classmethod
-    def add_message_line(cls, csv_file, status, error_message, error_args):
-        return ('%(time)s:\t%(profile)s '
-            '(%(profile_id)s)\t%(filename)s\t%(status)s\t%(message)s') % {
+    def _limit_logs(cls, csv_file, logs):
+        '''Keep the first log_lines lines of logs, as set in the import_csv
+        configuration section, and count the lines dropped'''
+        log_lines = config.getint('import_csv', 'log_lines',
+            default=LOG_LINES)
+        if len(logs) > log_lines:
+            try:
+                omitted = csv_file._omitted_log_lines
+            except AttributeError:
+                omitted = 0
+            csv_file._omitted_log_lines = omitted + len(logs) - log_lines
+            del logs[log_lines:]
+
+    @classmethod
+    def _finish_import(cls, csv_file, state, imported, logs):
+        'Store the state of the import and send its result'
+        cls._limit_logs(csv_file, logs)
+        try:
+            omitted = csv_file._omitted_log_lines
+        except AttributeError:
+            omitted = 0
+        if omitted:
+            logs.append(LogLine(
+                'done',
+                'log_lines_omitted',
+                (omitted,)))
+        if imported:
+            logs.insert(0, LogLine(
+                'done',
+                'import_successfully',
+                (imported,)))
+
+        cls.write([csv_file], {'state': state})
+        cls.commit()
+
+        if csv_file.profile_csv.email:
+            cls.send_message('\n'.join(cls.add_message_line(csv_file, *log)
+                    for log in logs))
+
+    @classmethod
+    def search_domains(cls, Model, domains):
+        '''Return the first record of Model found for each domain or None.
+        Domains of field = value clauses are searched in batches'''
+        results = [None] * len(domains)
+        groups = {}
+        for i, domain in enumerate(domains):
+            if not domain:
+                continue
+            if all(isinstance(clause, tuple) and clause[1] == '='
+                    and '.' not in clause[0] for clause in domain):
+                names = tuple(clause[0] for clause in domain)
+                groups.setdefault(names, []).append(i)
+            else:
+                records = Model.search(domain, limit=1)
+                if records:
+                    results[i] = records[0]
+        for names, indices in groups.items():
+            keys = [tuple(clause[2] for clause in domains[i])
+                for i in indices]
+            found = cls.search_records(Model, names, keys)
+            for i, key in zip(indices, keys):
+                results[i] = found.get(key)
+        return results
+
+    @classmethod
+    def message_header(cls, csv_file):
+        'Return the header of the log lines of the import started now'
+        return '%(time)s:\t%(profile)s (%(profile_id)s)\t%(filename)s' % {
             'time': datetime.now(),
             'profile': csv_file.profile_csv.rec_name,
             'profile_id': csv_file.profile_csv.id,
             'filename': csv_file.file_name,
-            'status': status,
-            'message': cls.raise_user_error(
-                error_message,
-                error_args=error_args,
-                raise_exception=False),
             }
 
+    @classmethod
+    def add_message_line(cls, csv_file, status, error_message, error_args):
+        # all the lines of an import share the time it was started at
+        try:
+            header = csv_file._message_header
+        except AttributeError:
+            header = csv_file._message_header = cls.message_header(csv_file)
+        return '%s\t%s\t%s' % (header, status,
+            cls.format_message(csv_file, error_message, error_args))
+
+    @classmethod
+    def format_message(cls, csv_file, error_message, error_args):
+        'Format the translated message, which is looked up once per file'
+        try:
+            templates = csv_file._message_templates
+        except AttributeError:
+            templates = csv_file._message_templates = {}
+        template = templates.get(error_message)
+        if template is None:
+            template = templates[error_message] = cls.raise_user_error(
+                error_message, raise_exception=False)
+        try:
+            return template % error_args
+        except (TypeError, KeyError):
+            return template
+
     @classmethod
     def import_file_default(cls, csv_file):
         '''Default Import CSV'''
@@ -571,6 +1028,9 @@ class ImportCSVFile(ModelSQL, ModelView):
         has_header = profile_csv.header
         skip_repeated = csv_file.skip_repeated
         update_record = csv_file.update_record
+        skip_errors = csv_file.skip_errors
+        chunk_size = config.getint('import_csv', 'chunk_size',
+            default=CHUNK_SIZE)
 
         Model = pool.get(model.model)
 
@@ -578,92 +1038,117 @@ class ImportCSVFile(ModelSQL, ModelView):
         if has_header:
             next(data, None)
 
+        columns = profile_csv.columns
+        # field names of the columns and whether they are added to the domain
+        fields_ = [(column.field.name, column.add_to_domain)
+            for column in columns]
+        domain_fields = [name for name, add_to_domain in fields_
+            if add_to_domain]
+        domain_indices = [i for i, (_, add_to_domain) in enumerate(fields_)
+            if add_to_domain]
+        # number of cells a row needs to have a value for every column
+        min_cells = max([i + 1 for column in columns
+                for i in column.column_indices] or [0])
         logs = []
-        to_save = []
-        for row in data:
-            if not row:
-                continue
-
-            domain = []
-            values = {}
-            for column in profile_csv.columns:
-                # each column, get value and assign in dict
-                if column.constant:
-                    value = column.constant
-                else:
-                    cells = column.column.split(',')
-                    try:
-                        vals = [row[int(c)] for c in cells if c]
-                    except IndexError:
-                        cls.raise_user_error('csv_format_error')
-                    value = column.get_value(vals)
-
-                if column.add_to_domain:
-                    domain.append((column.field.name, '=', value))
-
-                values[column.field.name] = value
-
-            if domain:
-                # search record exist
-                records = Model().search(domain, limit=1)
-
-                if skip_repeated and records:
-                    logs.append(cls.add_message_line(
-                        csv_file,
-                        'skipped',
-                        'record_already_exists',
-                        (records[0].rec_name,)))
-                    continue
-
-                if update_record and records:
-                    record, = records  # to update
-                    logs.append(cls.add_message_line(
-                        csv_file,
-                        'done',
-                        'record_updated',
-                        (values)))
-                else:
-                    record = Model()  # to create
-                    logs.append(cls.add_message_line(
-                        csv_file,
-                        'done',
-                        'record_added',
-                        (values)))
-            else:
-                record = Model()  # to create
-                logs.append(cls.add_message_line(
-                    csv_file,
-                    'done',
-                    'record_added',
-                    (values)))
-
-            # assign values to object record
-            for k, v in values.iteritems():
-                setattr(record, k, v)
-            to_save.append(record)
-
+        imported = 0
         state = 'done'
-        if to_save:
+        for rows in chunked(data, chunk_size):
+            rows_to_import = []
+            for row in rows:
+                try:
+                    if cls.row_to_import(profile_csv, row, min_cells):
+                        rows_to_import.append(row)
+                except UserError as e:
+                    if not skip_errors:
+                        raise
+                    logs.append(LogLine(
+                        'skipped',
+                        'row_skipped',
+                        (row, e.message)))
+            rows = rows_to_import
+            # convert the values of the chunk column by column
             try:
-                Model.save(to_save)
-                logs.insert(0, cls.add_message_line(
-                    csv_file,
+                columns_values = [column.get_values(rows)
+                    for column in columns]
+            except UserError:
+                if not skip_errors:
+                    raise
+                # convert row by row to skip only the rows with errors
+                rows_values = []
+                for row in rows:
+                    try:
+                        rows_values.append([column.get_values([row])[0]
+                                for column in columns])
+                    except UserError as e:
+                        logs.append(LogLine(
+                            'skipped',
+                            'row_skipped',
+                            (row, e.message)))
+                columns_values = list(zip(*rows_values))
+
+            rows_values = list(zip(*columns_values))
+            keys = [tuple(row_values[i] for i in domain_indices)
+                for row_values in rows_values]
+            # search the existing records of the whole chunk at once
+            found = (cls.search_records(Model, domain_fields, keys)
+                if domain_fields else {})
+
+            to_create = []
+            to_write = []
+            # domains of the chunk records, which are not saved yet
+            seen = set()
+            for row_values, key in zip(rows_values, keys):
+                values = {}
+                for (field_name, _), value in zip(fields_, row_values):
+                    values[field_name] = value
+
+                if domain_fields:
+                    if skip_repeated and key in seen:
+                        logs.append(LogLine(
+                            'skipped',
+                            'record_already_exists',
+                            (values,)))
+                        continue
+                    seen.add(key)
+
+                    records = [found[key]] if key in found else []
+
+                    if skip_repeated and records:
+                        logs.append(LogLine(
+                            'skipped',
+                            'record_already_exists',
+                            (records[0].rec_name,)))
+                        continue
+
+                    if update_record and records:
+                        to_write.extend((records, values))  # to update
+                        logs.append(LogLine(
+                            'done',
+                            'record_updated',
+                            (values,)))
+                        continue
+
+                to_create.append(values)
+                logs.append(LogLine(
                     'done',
-                    'import_successfully',
-                    (len(to_save),)))
-            except:
+                    'record_added',
+                    (values,)))
+
+            # save each chunk instead of keeping every record of the file
+            # in memory until the end, with plain values instead of
+            # instances to avoid tracking the changes of each field
+            def save():
+                if to_create:
+                    Model.create(to_create)
+                if to_write:
+                    Model.write(*to_write)
+            count = len(to_create) + len(to_write) // 2
+            if not cls._save_chunk(csv_file, save, count, logs):
                 state = 'error'
-                logs.insert(0, cls.add_message_line(
-                    csv_file,
-                    'error',
-                    'import_unsuccessfully',
-                    (len(to_save),)))
+                break
+            imported += count
 
-        cls.write([csv_file], {'state': state})
-        Transaction().connection.commit()  # force to commit
-
-        if profile_csv.email:
-            cls.send_message('\n'.join(logs))
+        cls._finish_import(csv_file, state, imported, logs)
 
     @classmethod
     def import_file_party(cls, csv_file):
@@ -684,191 +1169,193 @@ class ImportCSVFile(ModelSQL, ModelView):
         if has_header:
             next(data, None)
 
-        # Create a new list with parent and child values for each record
+        # Yield the parent and child values of each record
         # Group CSV lines in same record. See party.csv example in test
-        # rows = [{
+        # {
         #    'record': {},
         #    'domain': [],
         #    }
-        rows = []
-        for row in data:
-            is_party = True
-            is_address = False
-            is_contact = False
-
-            identifiers = []
-            domain = []
-            values = {}
-            for column in profile_csv.columns:
-                # each column, get value and assign in dict
-                cells = column.column.split(',')
-                cell = int(cells[0])
-
-                if column.constant:
-                    value = column.constant
-                else:
-                    try:
-                        vals = [row[int(c)] for c in cells if c]
-                    except IndexError:
-                        cls.raise_user_error('csv_format_error')
-                    value = column.get_value(vals)
-
-                if column.field.name == 'addresses' and row[cell]:
-                    is_address = True
-                    is_party = False
-                    values[column.subfield.name] = value
-                    if column.add_to_domain:
-                        domain.append(
-                            ('addresses.' + column.subfield.name, '=', value))
-                    continue
-                elif column.field.name == 'contact_mechanisms' and row[cell]:
-                    is_contact = True
-                    is_party = False
-                    values[column.subfield.name] = value
-                    if column.add_to_domain:
-                        domain.append(
-                            ('contact_mechanisms.' + column.subfield.name,
-                                '=', value))
+        # resolve the settings of each column once instead of on every row
+        columns = [(column, column.column_indices, column.field.name,
+                column.subfield.name if column.subfield else None)
+            for column in profile_csv.columns]
+        # number of cells a row needs to have a value for every column
+        min_cells = max([i + 1 for _, indices, _, _ in columns
+                for i in indices] or [0])
+
+        def party_rows():
+            # a party is complete when the next party row is read
+            party_row = None
+            for row in data:
+                if not cls.row_to_import(profile_csv, row, min_cells):
                     continue
-                elif column.field.name == 'identifiers' and row[cell]:
-                    identifiers.append({'code': value})
-                elif row[cell]:
-                    values[column.field.name] = value
-                    domain.append((column.field.name, '=', value))
-
-            # add values in rows
-            if is_address and values:
-                rows[-1]['record']['addresses'].append(values)
-                if domain:
-                    rows[-1]['domain'].append(domain)
-            elif is_contact and values:
-                rows[-1]['record']['contact_mechanisms'].append(values)
-                if domain:
-                    rows[-1]['domain'].append(domain)
-            elif is_party and values:
-                values['addresses'] = []
-                values['contact_mechanisms'] = []
-                values['identifiers'] = identifiers
-                rows.append({
-                    'record': values,
-                    'domain': domain if domain else None,
-                    })
-
-        # convert dict values to object and save
+                is_party = True
+                is_address = False
+                is_contact = False
+
+                identifiers = []
+                domain = []
+                values = {}
+                for column, _, field_name, subfield_name in columns:
+                    # each column, get value and assign in dict, as the
+                    # default import does with constants and empty cells
+                    value, = column.get_values([row])
+                    if value is None:
+                        continue
+
+                    if field_name == 'addresses':
+                        is_address = True
+                        is_party = False
+                        values[subfield_name] = value
+                        if column.add_to_domain:
+                            domain.append(
+                                ('addresses.' + subfield_name, '=', value))
+                        continue
+                    elif field_name == 'contact_mechanisms':
+                        is_contact = True
+                        is_party = False
+                        values[subfield_name] = value
+                        if column.add_to_domain:
+                            domain.append(
+                                ('contact_mechanisms.' + subfield_name,
+                                    '=', value))
+                        continue
+                    elif field_name == 'identifiers':
+                        identifiers.append({'code': value})
+                    else:
+                        values[field_name] = value
+                        domain.append((field_name, '=', value))
+
+                # add values in rows
+                if is_address and values:
+                    party_row['record']['addresses'].append(values)
+                    if domain:
+                        party_row['domain'].append(domain)
+                elif is_contact and values:
+                    party_row['record']['contact_mechanisms'].append(values)
+                    if domain:
+                        party_row['domain'].append(domain)
+                elif is_party and values:
+                    if party_row:
+                        yield party_row
+                    values['addresses'] = []
+                    values['contact_mechanisms'] = []
+                    values['identifiers'] = identifiers
+                    party_row = {
+                        'record': values,
+                        'domain': domain if domain else None,
+                        }
+            if party_row:
+                yield party_row
+
+        # convert dict values to object and save each chunk of parties
         logs = []
-        to_save = []
-        for row in rows:
-            domain = row['domain']
-            data = row['record']
-
-            addresses = data['addresses']
-            del data['addresses']
-            contact_mechanisms = data['contact_mechanisms']
-            del data['contact_mechanisms']
-            identifiers = data['identifiers']
-            del data['identifiers']
-
-            # search record exist (party)
-            if domain:
-                records = Party.search(domain, limit=1)
-
-                if skip_repeated and records:
-                    logs.append(cls.add_message_line(
-                        csv_file,
-                        'skipped',
-                        'record_already_exists',
-                        (records[0].rec_name,)))
-                    continue
-
-                if update_record and records:
-                    record, = records  # to update
-                    logs.append(cls.add_message_line(
-                        csv_file,
-                        'done',
-                        'record_updated',
-                        (row)))
+        state = 'done'
+        imported = 0
+        chunk_size = config.getint('import_csv', 'chunk_size',
+            default=CHUNK_SIZE)
+        for rows in chunked(party_rows(), chunk_size):
+            to_save = []
+            # search the existing records of the whole chunk at once
+            existing = cls.search_domains(Party,
+                [row['domain'] for row in rows])
+            # domains of the chunk records, which are not saved yet
+            seen = set()
+            for row, found in zip(rows, existing):
+                domain = row['domain']
+                values = row['record']
+
+                addresses = values['addresses']
+                del values['addresses']
+                contact_mechanisms = values['contact_mechanisms']
+                del values['contact_mechanisms']
+                identifiers = values['identifiers']
+                del values['identifiers']
+
+                # search record exist (party)
+                if domain:
+                    key = domain_key(domain)
+                    if skip_repeated and key in seen:
+                        logs.append(LogLine(
+                            'skipped',
+                            'record_already_exists',
+                            (values,)))
+                        continue
+                    seen.add(key)
+
+                    records = [found] if found else []
+
+                    if skip_repeated and records:
+                        logs.append(LogLine(
+                            'skipped',
+                            'record_already_exists',
+                            (records[0].rec_name,)))
+                        continue
+
+                    if update_record and records:
+                        record, = records  # to update
+                        logs.append(LogLine(
+                            'done',
+                            'record_updated',
+                            (values,)))
+                    else:
+                        record = Party()  # to create
+                        logs.append(LogLine(
+                            'done',
+                            'record_added',
+                            (values,)))
                 else:
                     record = Party()  # to create
-                    logs.append(cls.add_message_line(
-                        csv_file,
+                    logs.append(LogLine(
                         'done',
                         'record_added',
-                        (row)))
-            else:
-                record = Party()  # to create
-                logs.append(cls.add_message_line(
-                    csv_file,
-                    'done',
-                    'record_added',
-                    (row)))
-
-            # assign values to object record
-            # (party, address, contact mechanism and identifier)
-            for k, v in data.iteritems():
-                setattr(record, k, v)
-            if not hasattr(record, 'addresses'):
-                record.addresses = ()
-            if not hasattr(record, 'contact_mechanisms'):
-                record.contact_mechanisms = ()
-            if not hasattr(record, 'identifiers'):
-                record.identifiers = ()
-
-            addrs = ()
-            for addr in addresses:
-                address = Address()
-                for k, v in addr.iteritems():
-                    setattr(address, k, v)
-                address.on_change_country()
-                try:  # country_zip
-                    address.on_change_zip()
-                except:
-                    pass
-                addrs += (address,)
-            if addrs:
-                record.addresses += addrs
-
-            cms = ()
-            for cm in contact_mechanisms:
-                contact = ContactMechanism()
-                for k, v in cm.iteritems():
-                    setattr(contact, k, v)
-                cms += (contact,)
-            if cms:
-                record.contact_mechanisms += cms
-
-            idens = ()
-            for iden in identifiers:
-                identifier = PartyIdentifier()
-                for k, v in iden.iteritems():
-                    setattr(identifier, k, v)
-                idens += (identifier,)
-            if idens:
-                record.identifiers += idens
-
-            to_save.append(record)  # to save
-
-        state = 'done'
-        if to_save:
-            try:
-                Party.save(to_save)
-                logs.insert(0, cls.add_message_line(
-                    csv_file,
-                    'done',
-                    'import_successfully',
-                    (len(to_save),)))
-            except:
+                        (values,)))
+
+                # assign values to object record
+                # (party, address, contact mechanism and identifier)
+                for k, v in values.items():
+                    setattr(record, k, v)
+                if not hasattr(record, 'addresses'):
+                    record.addresses = ()
+                if not hasattr(record, 'contact_mechanisms'):
+                    record.contact_mechanisms = ()
+                if not hasattr(record, 'identifiers'):
+                    record.identifiers = ()
+
+                addrs = []
+                for addr in addresses:
+                    address = Address(**addr)
+                    address.on_change_country()
+                    try:  # country_zip
+                        address.on_change_zip()
+                    except Exception:
+                        pass
+                    addrs.append(address)
+                if addrs:
+                    record.addresses += tuple(addrs)
+
+                cms = []
+                for cm in contact_mechanisms:
+                    contact = ContactMechanism(**cm)
+                    cms.append(contact)
+                if cms:
+                    record.contact_mechanisms += tuple(cms)
+
+                idens = []
+                for iden in identifiers:
+                    identifier = PartyIdentifier(**iden)
+                    idens.append(identifier)
+                if idens:
+                    record.identifiers += tuple(idens)
+
+                to_save.append(record)  # to save
+
+            if not cls._save_chunk(csv_file,
+                    lambda: Party.save(to_save), len(to_save), logs):
                 state = 'error'
-                logs.insert(0, cls.add_message_line(
-                    csv_file,
-                    'error',
-                    'import_unsuccessfully',
-                    (len(to_save),)))
-
-        cls.write([csv_file], {'state': state})
-        Transaction().connection.commit()  # force to commit
-
-        if profile_csv.email:
-            cls.send_message('\n'.join(logs))
+                break
+            imported += len(to_save)
+        cls._finish_import(csv_file, state, imported, logs)
 
     @classmethod
     def import_file_sale(cls, csv_file):
@@ -888,149 +1375,158 @@ class ImportCSVFile(ModelSQL, ModelView):
         if has_header:
             next(data, None)
 
-        # Create a new list with parent and child values for each record
+        # Yield the parent and child values of each record
         # Group CSV lines in same record. See party.csv example in test
-        # rows = [{
+        # {
         #    'record': {},
         #    'domain': [],
         #    }
-        rows = []
-        for row in data:
-            is_sale = True
-            is_line = False
-
-            domain = []
-            values = {}
-            for column in profile_csv.columns:
-                # each column, get value and assign in dict
-                cells = column.column.split(',')
-                cell = int(cells[0])
-
-                if column.constant:
-                    value = column.constant
-                else:
-                    try:
-                        vals = [row[int(c)] for c in cells if c]
-                    except IndexError:
-                        cls.raise_user_error('csv_format_error')
-                    value = column.get_value(vals)
-
-                if column.field.name == 'line' and row[cell]:
-                    is_line = True
-                    is_sale = False
-                    if column.subfield.name == 'product':
-                        products = Product.search([
-                            ('rec_name', '=', value),
-                            ])
-                        if products:
-                            values[column.subfield.name] = value
-                        else:
-                            values['description'] = value
-                    if column.add_to_domain:
-                        domain.append(
-                            ('lines.' + column.subfield.name, '=', value))
+        # resolve the settings of each column once instead of on every row
+        columns = [(column, column.column_indices, column.field.name,
+                column.subfield.name if column.subfield else None)
+            for column in profile_csv.columns]
+        # number of cells a row needs to have a value for every column
+        min_cells = max([i + 1 for _, indices, _, _ in columns
+                for i in indices] or [0])
+        # whether a product exists, searched once for each product name
+        product_names = {}
+
+        def sale_rows():
+            # a sale is complete when the next sale row is read
+            sale_row = None
+            for row in data:
+                if not cls.row_to_import(profile_csv, row, min_cells):
                     continue
-                elif row[cell]:
-                    values[column.field.name] = value
-                    domain.append((column.field.name, '=', value))
-
-            # add values in rows
-            if is_line and values:
-                rows[-1]['record']['lines'].append(values)
-                if domain:
-                    rows[-1]['domain'].append(domain)
-            elif is_sale and values:
-                values['lines'] = []
-                rows.append({
-                    'record': values,
-                    'domain': domain if domain else None,
-                    })
-
-        # convert dict values to object and save
+                is_sale = True
+                is_line = False
+
+                domain = []
+                values = {}
+                for column, _, field_name, subfield_name in columns:
+                    # each column, get value and assign in dict, as the
+                    # default import does with constants and empty cells
+                    value, = column.get_values([row])
+                    if value is None:
+                        continue
+
+                    if field_name == 'line':
+                        is_line = True
+                        is_sale = False
+                        if subfield_name == 'product':
+                            if value not in product_names:
+                                product_names[value] = bool(Product.search([
+                                            ('rec_name', '=', value),
+                                            ], limit=1))
+                            if product_names[value]:
+                                values[subfield_name] = value
+                            else:
+                                values['description'] = value
+                        if column.add_to_domain:
+                            domain.append(
+                                ('lines.' + subfield_name, '=', value))
+                        continue
+                    else:
+                        values[field_name] = value
+                        domain.append((field_name, '=', value))
+
+                # add values in rows
+                if is_line and values:
+                    sale_row['record']['lines'].append(values)
+                    if domain:
+                        sale_row['domain'].append(domain)
+                elif is_sale and values:
+                    if sale_row:
+                        yield sale_row
+                    values['lines'] = []
+                    sale_row = {
+                        'record': values,
+                        'domain': domain if domain else None,
+                        }
+            if sale_row:
+                yield sale_row
+
+        # convert dict values to object and save each chunk of sales
         logs = []
-        to_save = []
-        for row in rows:
-            domain = row['domain']
-            data = row['record']
-
-            lines = data['lines']
-            del data['lines']
-
-            # search record exist (party)
-            if domain:
-                records = Sale.search(domain, limit=1)
-
-                if skip_repeated and records:
-                    logs.append(cls.add_message_line(
-                        csv_file,
-                        'skipped',
-                        'record_already_exists',
-                        (records[0].rec_name,)))
-                    continue
-
-                if update_record and records:
-                    record, = records  # to update
-                    logs.append(cls.add_message_line(
-                        csv_file,
-                        'done',
-                        'record_updated',
-                        (row)))
+        state = 'done'
+        imported = 0
+        chunk_size = config.getint('import_csv', 'chunk_size',
+            default=CHUNK_SIZE)
+        for rows in chunked(sale_rows(), chunk_size):
+            to_save = []
+            # search the existing records of the whole chunk at once
+            existing = cls.search_domains(Sale,
+                [row['domain'] for row in rows])
+            # domains of the chunk records, which are not saved yet
+            seen = set()
+            for row, found in zip(rows, existing):
+                domain = row['domain']
+                values = row['record']
+
+                lines = values['lines']
+                del values['lines']
+
+                # search record exist (party)
+                if domain:
+                    key = domain_key(domain)
+                    if skip_repeated and key in seen:
+                        logs.append(LogLine(
+                            'skipped',
+                            'record_already_exists',
+                            (values,)))
+                        continue
+                    seen.add(key)
+
+                    records = [found] if found else []
+
+                    if skip_repeated and records:
+                        logs.append(LogLine(
+                            'skipped',
+                            'record_already_exists',
+                            (records[0].rec_name,)))
+                        continue
+
+                    if update_record and records:
+                        record, = records  # to update
+                        logs.append(LogLine(
+                            'done',
+                            'record_updated',
+                            (values,)))
+                    else:
+                        record = Sale()  # to create
+                        logs.append(LogLine(
+                            'done',
+                            'record_added',
+                            (values,)))
                 else:
                     record = Sale()  # to create
-                    logs.append(cls.add_message_line(
-                        csv_file,
+                    logs.append(LogLine(
                         'done',
                         'record_added',
-                        (row)))
-            else:
-                record = Sale()  # to create
-                logs.append(cls.add_message_line(
-                    csv_file,
-                    'done',
-                    'record_added',
-                    (row)))
-
-            # assign values to object record
-            # (sale and line)
-            for k, v in data.iteritems():
-                setattr(record, k, v)
-            if not hasattr(record, 'lines'):
-                record.lines = ()
-
-            sale_lines = ()
-            for l in lines:
-                line = Line()
-                for k, v in l.iteritems():
-                    setattr(line, k, v)
-                line.on_change_product()
-                sale_lines += (line,)
-            if sale_lines:
-                record.lines += sale_lines
-
-            to_save.append(record)  # to save
-
-        state = 'done'
-        if to_save:
-            try:
-                Sale.save(to_save)
-                logs.insert(0, cls.add_message_line(
-                    csv_file,
-                    'done',
-                    'import_successfully',
-                    (len(to_save),)))
-            except:
+                        (values,)))
+
+                # assign values to object record
+                # (sale and line)
+                for k, v in values.items():
+                    setattr(record, k, v)
+                if not hasattr(record, 'lines'):
+                    record.lines = ()
+
+                sale_lines = []
+                for l in lines:
+                    line = Line(**l)
+                    line.on_change_product()
+                    sale_lines.append(line)
+                if sale_lines:
+                    record.lines += tuple(sale_lines)
+
+                to_save.append(record)  # to save
+
+            if not cls._save_chunk(csv_file,
+                    lambda: Sale.save(to_save), len(to_save), logs):
                 state = 'error'
-                logs.insert(0, cls.add_message_line(
-                    csv_file,
-                    'error',
-                    'import_unsuccessfully',
-                    (len(to_save),)))
-
-        cls.write([csv_file], {'state': state})
-        Transaction().connection.commit()  # force to commit
-
-        if profile_csv.email:
-            cls.send_message('\n'.join(logs))
+                break
+            imported += len(to_save)
+        cls._finish_import(csv_file, state, imported, logs)
 
     @classmethod
     @ModelView.button
@@ -1038,6 +1534,24 @@ class ImportCSVFile(ModelSQL, ModelView):
         '''Import CSV'''
         for csv_file in csv_files:
             profile_csv = csv_file.profile_csv
-            import_csv = getattr(cls, 'import_file_%s' %
-                profile_csv.method)
-            import_csv(csv_file)
+            # modules extend the methods, so they are looked up on the class
+            import_csv = getattr(cls, 'import_file_%s' % profile_csv.method,
+                None)
+            if not import_csv:
+                cls.raise_user_error('method_not_found',
+                    error_args=(profile_csv.method, profile_csv.rec_name))
+            csv_file._message_header = cls.message_header(csv_file)
+            if not cls.commit_chunks():
+                import_csv(csv_file)
+                continue
+            try:
+                import_csv(csv_file)
+            except Exception as e:
+                # the chunks saved before the error are already committed,
+                # so the import can not be undone nor run again
+                logger.exception('Import of CSV file %s failed', csv_file.id)
+                cls.rollback()
+                message = (e.message if isinstance(e, UserError)
+                    else repr(e))
+                cls._finish_import(csv_file, 'error', 0,
+                    [LogLine('error', 'import_error', (message,))])
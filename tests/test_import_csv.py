@@ -3,15 +3,148 @@
 # copyright notices and license terms.
 import unittest
 import doctest
+from datetime import time
+from decimal import Decimal
 import trytond.tests.test_tryton
-from trytond.tests.test_tryton import ModuleTestCase
+from trytond.tests.test_tryton import ModuleTestCase, with_transaction
 from trytond.tests.test_tryton import doctest_teardown, doctest_checker
+from trytond.exceptions import UserError
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+from trytond.modules.import_csv.import_csv import LogLine, LOG_LINES
 
 
 class ImportCsvTestCase(ModuleTestCase):
     'Test Import Csv module'
     module = 'import_csv'
 
+    def create_file(self, model, fields, csv_file, **values):
+        '''Return a stored CSV file of a default profile of model that
+        imports each of the fields from the next column'''
+        pool = Pool()
+        Model = pool.get('ir.model')
+        Field = pool.get('ir.model.field')
+        ImportCSV = pool.get('import.csv')
+        ImportCSVFile = pool.get('import.csv.file')
+
+        model, = Model.search([('model', '=', model)])
+        columns = []
+        for i, name in enumerate(fields):
+            field, = Field.search([
+                    ('model', '=', model.id),
+                    ('name', '=', name),
+                    ])
+            columns.append({
+                    'column': str(i),
+                    'field': field.id,
+                    })
+        profile_values = {
+            'name': 'Test',
+            'model': model.id,
+            'method': 'default',
+            'columns': [('create', columns)],
+            }
+        profile_values.update(values)
+        profile, = ImportCSV.create([profile_values])
+        csv_file, = ImportCSVFile.create([{
+                    'profile_csv': profile.id,
+                    'csv_file': csv_file,
+                    'file_name': 'test.csv',
+                    }])
+        return csv_file
+
+    @with_transaction()
+    def test_get_boolean(self):
+        'Test boolean cells'
+        csv_file = self.create_file('ir.sequence', ['active'], b'1\n')
+        column, = csv_file.profile_csv.columns
+        self.assertEqual(column.get_values([['1'], ['True'], [' yes ']]),
+            [True, True, True])
+        self.assertEqual(column.get_values([['0'], ['false'], ['No']]),
+            [False, False, False])
+        self.assertEqual(column.get_values([['']]), [None])
+        with self.assertRaises(UserError):
+            column.get_values([['maybe']])
+
+    @with_transaction()
+    def test_get_numeric(self):
+        'Test numeric cells'
+        csv_file = self.create_file('ir.sequence', ['name'], b'1,5\n',
+            thousands_separator='.', decimal_separator=',')
+        column, = csv_file.profile_csv.columns
+        # no model of the tested modules has a numeric field
+        column.ttype = 'numeric'
+        self.assertEqual(column.get_values([[u'1.234,5'], [u'-2']]),
+            [Decimal('1234.5000'), Decimal('-2.0000')])
+        for value in [u'1,2,3', u'1e100', u'1' * 30]:
+            with self.assertRaises(UserError):
+                column.get_values([[value]])
+
+    @with_transaction()
+    def test_get_time(self):
+        'Test time cells'
+        csv_file = self.create_file('ir.sequence', ['name'], b'09:30\n')
+        column, = csv_file.profile_csv.columns
+        # no model of the tested modules has a time field
+        column.ttype = 'time'
+        column.date_format = '%H:%M'
+        self.assertEqual(column.get_values([['09:30'], ['23:05']]),
+            [time(9, 30), time(23, 5)])
+        with self.assertRaises(UserError):
+            column.get_values([['9.30']])
+
+    @with_transaction()
+    def test_method_not_found(self):
+        '''Test a profile with an import method that is not available.
+        The method is changed in the table, as the profiles only accept the
+        methods of the activated modules'''
+        pool = Pool()
+        ImportCSV = pool.get('import.csv')
+        ImportCSVFile = pool.get('import.csv.file')
+        table = ImportCSV.__table__()
+        cursor = Transaction().connection.cursor()
+
+        csv_file = self.create_file('ir.sequence', ['name'], b'Test\n')
+        cursor.execute(*table.update([table.method], ['unknown'],
+                where=table.id == csv_file.profile_csv.id))
+        Transaction().cache.clear()
+        with self.assertRaises(UserError):
+            ImportCSVFile.import_file([ImportCSVFile(csv_file.id)])
+
+    @with_transaction()
+    def test_save_error_keeps_transaction(self):
+        'Test a chunk that can not be saved does not discard other changes'
+        pool = Pool()
+        Sequence = pool.get('ir.sequence')
+        ImportCSV = pool.get('import.csv')
+        ImportCSVFile = pool.get('import.csv.file')
+
+        # the profile and the file are changes of the caller that are not
+        # committed yet, and the sequence without name can not be saved
+        csv_file = self.create_file('ir.sequence', ['name', 'code'],
+            b'Imported,unknown\n,unknown\n')
+        with self.assertRaises(UserError):
+            ImportCSVFile.import_file([csv_file])
+        self.assertEqual(ImportCSV.search([]), [csv_file.profile_csv])
+        self.assertEqual(ImportCSVFile.search([]), [csv_file])
+        self.assertEqual(Sequence.search([('name', '=', 'Imported')]), [])
+
+
+    @with_transaction()
+    def test_limit_logs(self):
+        'Test the log lines of the rows kept for the result email'
+        pool = Pool()
+        ImportCSVFile = pool.get('import.csv.file')
+
+        csv_file = self.create_file('ir.sequence', ['name'], b'Test\n')
+        logs = [LogLine('done', 'record_added', (i,))
+            for i in range(LOG_LINES + 5)]
+        ImportCSVFile._limit_logs(csv_file, logs)
+        self.assertEqual(len(logs), LOG_LINES)
+        self.assertEqual(logs[-1].error_args, (LOG_LINES - 1,))
+        ImportCSVFile._limit_logs(csv_file, logs + logs[:2])
+        self.assertEqual(csv_file._omitted_log_lines, 7)
+
 
 def suite():
     suite = trytond.tests.test_tryton.suite()
@@ -5,9 +5,6 @@ __all__ = ['read_csv_file']
 
 
 def read_csv_file(filename):
-    with open(filename) as f:
-        data = f.read()
-        # On python3 we must cast to bytes with valid encoding
-        if bytes != str:
-            data = bytes(data, encoding=f.encoding)
-    return data
+    # the binary field stores the bytes of the file as they are
+    with open(filename, 'rb') as f:
+        return f.read()